@@ -4,104 +4,208 @@
 # Type: python3
 
 import datetime
-from typing import Dict, List
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
 
-def check_health_dataset(threshold_hours: float = 1.0) -> List[Dict]:
+# Entry type of failed command results, resolved once
+ERROR_ENTRY_TYPE = entryTypes['error']
+
+# Query the custom dataset (very low CU consumption)
+# The dataset is overwritten on every scheduled run, so the 2h window
+# needed by the freshness check also covers the latest silent rows
+HEALTH_QUERY_TEMPLATE = """
+config timeframe = 2h
+| dataset = custom.data_source_health
+| comp max(check_time) as latest_check
+| alter kind = "freshness"
+| fields kind, latest_check
+| union (
+    dataset = custom.data_source_health
+    | filter hours_silent >= {threshold_hours:.3f}
+    | alter kind = "silent"
+    | fields kind, dataset_name, last_seen_time, hours_silent, severity, 
+             event_count_last_hour, status
+    | sort hours_silent desc
+    | limit {max_results}
+)
+"""
+
+# Silent sources only, used while a cached freshness result is still valid
+# check_time is projected here since the cached update time may predate these rows
+SILENT_QUERY_TEMPLATE = """
+config timeframe = 2h
+| dataset = custom.data_source_health
+| filter hours_silent >= {threshold_hours:.3f}
+| alter kind = "silent"
+| fields kind, dataset_name, last_seen_time, hours_silent, severity, 
+         event_count_last_hour, status, check_time
+| sort hours_silent desc
+| limit {max_results}
+"""
+
+# Upper bound for threshold_hours (30 days)
+MAX_THRESHOLD_HOURS = 720.0
+
+# Default cap on silent rows returned by the query
+DEFAULT_MAX_RESULTS = 500
+
+# Seconds a fresh result of the freshness check is reused
+FRESHNESS_CACHE_TTL = 60
+
+def to_epoch_seconds(timestamp: float) -> float:
     """
-    Check the custom dataset for silent data sources
-    This is much more CU-efficient than querying raw data
+    Normalize an XQL timestamp to epoch seconds, values above 1e11 are taken as milliseconds
     """
-    
-    # Query the custom dataset (very low CU consumption)
-    xql_query = f"""
-    config timeframe = 1h
-    | dataset = custom.data_source_health
-    | filter hours_silent >= {threshold_hours}
-    | sort hours_silent desc
-    | fields dataset_name, last_seen_time, hours_silent, severity, 
-             event_count_last_hour, status, check_time
+    timestamp = float(timestamp)
+    return timestamp / 1000 if timestamp > 1e11 else timestamp
+
+def format_timestamp(timestamp: float) -> str:
+    """
+    Format an epoch timestamp as a UTC string
+    A missing or non-numeric timestamp is rendered as 'Unknown' instead of failing the row
     """
-    
     try:
-        results = demisto.executeCommand('xdr-xql-generic-query', {
-            'query': xql_query,
-            'time_frame': 'custom',
-            'start_time': '1 hour ago'
-        })
-        
-        if not results or results[0].get('Type') == entryTypes['error']:
-            return_error(f"Failed to query health dataset: {results[0].get('Contents')}")
-        
-        query_results = results[0].get('Contents', {}).get('results', [])
-        
-        # Process and format results
-        silent_datasets = []
-        for row in query_results:
-            dataset_info = {
-                'dataset': row.get('dataset_name'),
-                'last_seen': datetime.datetime.fromtimestamp(
-                    row.get('last_seen_time', 0)
-                ).strftime('%Y-%m-%d %H:%M:%S UTC'),
-                'last_seen_timestamp': row.get('last_seen_time', 0),
-                'hours_silent': row.get('hours_silent', 0),
-                'severity': row.get('severity', 'Unknown'),
-                'event_count': row.get('event_count_last_hour', 0),
-                'status': row.get('status', 'Unknown'),
-                'last_check': datetime.datetime.fromtimestamp(
-                    row.get('check_time', 0)
-                ).strftime('%Y-%m-%d %H:%M:%S UTC')
-            }
-            silent_datasets.append(dataset_info)
-        
-        return silent_datasets
-        
+        return time.strftime('%Y-%m-%d %H:%M:%S UTC', time.gmtime(to_epoch_seconds(timestamp)))
+    except (TypeError, ValueError, OverflowError, OSError):
+        return 'Unknown'
+
+def get_cached_freshness() -> Optional[Dict]:
+    """
+    Return the cached freshness result if it was stored within the TTL and is still fresh
+    The cache is only an optimization, any failure reading it counts as a miss
+    """
+    try:
+        ctx = demisto.getIntegrationContext() or {}
     except Exception as e:
-        return_error(f"Error checking health dataset: {str(e)}")
+        demisto.debug(f"Freshness cache unavailable: {str(e)}")
+        return None
+    
+    if ctx.get('freshness_ts', 0) > time.time() - FRESHNESS_CACHE_TTL:
+        # Recompute the age from the cached update time so minutes_old stays accurate
+        freshness = verify_dataset_freshness(ctx.get('freshness', {}).get('last_update'))
+        if freshness['is_fresh']:
+            return freshness
+    return None
 
-def verify_dataset_freshness() -> Dict:
+def cache_freshness(freshness: Dict) -> None:
     """
-    Verify the custom dataset has recent data
+    Store the freshness result, stamped on write so expiry is deterministic
+    Failures are ignored so a missing integration context never fails the check
+    """
+    try:
+        ctx = demisto.getIntegrationContext() or {}
+        ctx.update({'freshness_ts': int(time.time()), 'freshness': freshness})
+        demisto.setIntegrationContext(ctx)
+    except Exception as e:
+        demisto.debug(f"Failed to cache freshness: {str(e)}")
+
+def check_health_dataset(threshold_hours: float = 1.0,
+                         max_results: int = DEFAULT_MAX_RESULTS) -> Tuple[Dict, List[Dict]]:
     """
-    freshness_query = """
-    config timeframe = 2h
-    | dataset = custom.data_source_health
-    | comp max(check_time) as latest_check
-    | alter minutes_old = (current_time() - latest_check) / 60
-    | fields latest_check, minutes_old
+    Check the custom dataset for freshness and silent data sources
+    Both are fetched in a single XQL round-trip, rows are tagged by a 'kind' column
+    Silent rows are returned unformatted, see iter_silent_rows, and capped at max_results
+    Query errors are raised so main reports them once
     """
     
+    # Skip the freshness part of the query while a cached result is valid
+    cached_freshness = get_cached_freshness()
+    query_template = SILENT_QUERY_TEMPLATE if cached_freshness else HEALTH_QUERY_TEMPLATE
+    xql_query = query_template.format(threshold_hours=float(threshold_hours), max_results=int(max_results))
+    
+    results = demisto.executeCommand('xdr-xql-generic-query', {
+        'query': xql_query
+    })
+    
+    if not results or results[0].get('Type') == ERROR_ENTRY_TYPE:
+        error = results[0].get('Contents') if results else 'no results returned'
+        raise DemistoException(f"Failed to query health dataset: {error}")
+    
+    query_results = results[0].get('Contents', {}).get('results', [])
+    
+    # Split the batched rows back into their source queries
+    freshness_rows = [row for row in query_results if row.get('kind') == 'freshness']
+    silent_rows = [row for row in query_results if row.get('kind') == 'silent']
+    
+    if cached_freshness:
+        freshness = cached_freshness
+    else:
+        latest_check = freshness_rows[0].get('latest_check') if freshness_rows else None
+        freshness = verify_dataset_freshness(latest_check)
+        # Only fresh results are cached so a stale dataset is re-checked every run
+        if freshness['is_fresh']:
+            cache_freshness(freshness)
+    
+    return freshness, silent_rows
+
+def iter_silent_rows(silent_rows: List[Dict], last_check: str) -> Iterator[Tuple[Dict, str]]:
+    """
+    Format silent rows in one pass, yielding the context output and markdown row for each
+    Rows carry their own check_time only when the freshness result was cached,
+    otherwise last_check from the same query is shared
+    """
+    for row in silent_rows:
+        dataset_info = {
+            'dataset': row.get('dataset_name'),
+            'last_seen': format_timestamp(row.get('last_seen_time', 0)),
+            'last_seen_timestamp': row.get('last_seen_time', 0),
+            'hours_silent': row.get('hours_silent', 0),
+            'severity': row.get('severity', 'Unknown'),
+            'event_count': row.get('event_count_last_hour', 0),
+            'status': row.get('status', 'Unknown'),
+            'last_check': format_timestamp(row['check_time']) if 'check_time' in row else last_check
+        }
+        table_row = (
+            f"| {dataset_info['dataset']} | {dataset_info['last_seen']} | {dataset_info['hours_silent']} "
+            f"| {dataset_info['severity']} | {dataset_info['status']} |\n"
+        )
+        yield dataset_info, table_row
+
+def verify_dataset_freshness(latest_check: Optional[float]) -> Dict:
+    """
+    Verify the custom dataset has recent data
+    The age is computed here rather than in XQL to save a query stage
+    A missing, non-numeric or future check time counts as not fresh
+    """
     try:
-        results = demisto.executeCommand('xdr-xql-generic-query', {
-            'query': freshness_query
-        })
-        
-        if results and results[0].get('Type') != entryTypes['error']:
-            data = results[0].get('Contents', {}).get('results', [])
-            if data:
-                return {
-                    'is_fresh': data[0].get('minutes_old', 999) < 35,
-                    'minutes_old': data[0].get('minutes_old', 999),
-                    'last_update': data[0].get('latest_check')
-                }
-        
-        return {'is_fresh': False, 'minutes_old': 999, 'last_update': None}
-        
-    except:
-        return {'is_fresh': False, 'minutes_old': 999, 'last_update': None}
+        latest_check = to_epoch_seconds(latest_check)
+    except (TypeError, ValueError):
+        latest_check = None
+    
+    if latest_check is not None:
+        minutes_old = (time.time() - latest_check) / 60
+        return {
+            'is_fresh': 0 <= minutes_old < 35,
+            'minutes_old': minutes_old,
+            'last_update': latest_check
+        }
+    
+    return {'is_fresh': False, 'minutes_old': 999, 'last_update': None}
 
 # Main execution
 def main():
-    args = demisto.args()
-    threshold_hours = float(args.get('threshold_hours', 1))
-    
-    # First verify dataset freshness
-    freshness = verify_dataset_freshness()
+    try:
+        args = demisto.args()
+        # Clamp and round once so identical thresholds produce identical query text
+        threshold_hours = round(max(0.0, min(float(args.get('threshold_hours', 1)), MAX_THRESHOLD_HOURS)), 3)
+        max_results = max(1, int(args.get('max_results', DEFAULT_MAX_RESULTS)))
+        
+        # Get dataset freshness and silent data sources in one query
+        freshness, silent_rows = check_health_dataset(threshold_hours, max_results)
+    except Exception as e:
+        return_error(f"Error checking health dataset: {str(e)}")
     
     if not freshness['is_fresh']:
         return_error(f"Health dataset is stale. Last update was {freshness['minutes_old']} minutes ago")
     
-    # Get silent data sources
-    silent_datasets = check_health_dataset(threshold_hours)
+    # Build context output and markdown rows in a single pass
+    # In the batched query every row comes from the run whose check time is the last update
+    last_check = format_timestamp(freshness['last_update'] or 0)
+    silent_datasets = []
+    table_rows = []
+    for dataset_info, table_row in iter_silent_rows(silent_rows, last_check):
+        silent_datasets.append(dataset_info)
+        table_rows.append(table_row)
     
     # Create output
     if silent_datasets:
@@ -109,9 +213,10 @@ def main():
         readable += f"*Dataset last updated: {freshness['minutes_old']:.1f} minutes ago*\n\n"
         readable += "| Dataset | Last Seen | Hours Silent | Severity | Status |\n"
         readable += "|---------|-----------|--------------|----------|--------|\n"
+        readable += "".join(table_rows)
         
-        for ds in silent_datasets:
-            readable += f"| {ds['dataset']} | {ds['last_seen']} | {ds['hours_silent']} | {ds['severity']} | {ds['status']} |\n"
+        if len(silent_datasets) >= max_results:
+            readable += f"\n*(showing top {max_results}; use max_results arg to see more)*\n"
     else:
         readable = "All data sources are reporting normally.\n"
         readable += f"*Checked at: {datetime.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S UTC')}*"
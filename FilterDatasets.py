@@ -4,20 +4,30 @@ from CommonServerPython import *
 def main():
     try:
         # Get inputs from the playbook context
-        all_datasets_raw = demisto.args().get('all_datasets_json')
-        excluded_datasets_raw = demisto.args().get('excluded_datasets_json')
-        exclusion_field = demisto.args().get('dataset_name_field', 'dataset_name')
+        args = demisto.args()
+        all_datasets_raw = args.get('all_datasets_json')
+        excluded_datasets_raw = args.get('excluded_datasets_json')
+        exclusion_field = args.get('dataset_name_field', 'dataset_name')
 
-        # Process the full list of datasets from the API call
-        # The API returns a list of dicts, e.g., [{'dataset_name': 'x', 'vendor': 'y'}, ...]
-        all_datasets_set = {ds.get('dataset_name') for ds in all_datasets_raw if ds.get('dataset_name')}
+        if not all_datasets_raw:
+            # Nothing to filter, skip hashing the excluded list entirely
+            final_datasets_list = []
+        else:
+            # Process the full list of datasets from the API call
+            # The API returns a list of dicts, e.g., [{'dataset_name': 'x', 'vendor': 'y'}, ...]
+            all_datasets_set = set(filter(None, (ds.get('dataset_name') for ds in all_datasets_raw)))
 
-        # Process the excluded list from the XQL query
-        # The query returns a list of dicts, e.g., [{'dataset_name': 'a'}, {'dataset_name': 'b'}]
-        excluded_datasets_set = {ds.get(exclusion_field) for ds in excluded_datasets_raw if ds.get(exclusion_field)}
+            if not excluded_datasets_raw:
+                # No exclusions, the full list is the result
+                final_datasets_list = sorted(all_datasets_set)
+            else:
+                # Process the excluded list from the XQL query
+                # The query returns a list of dicts, e.g., [{'dataset_name': 'a'}, {'dataset_name': 'b'}]
+                # Empty names never match since they were dropped from the full set
+                excluded_datasets = (ds.get(exclusion_field) for ds in excluded_datasets_raw)
 
-        # Find the difference using set operations
-        final_datasets_list = sorted(list(all_datasets_set - excluded_datasets_set))
+                # Find the difference, consuming the excluded names without building a set
+                final_datasets_list = sorted(all_datasets_set.difference(excluded_datasets))
 
         # Return the final list to the playbook context
         return_results(CommandResults(
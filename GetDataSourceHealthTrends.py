@@ -4,109 +4,150 @@
 # Type: python3
 
 import datetime
+import re
+from collections import defaultdict
 from typing import Dict, List
 
+# Entry type of failed command results, resolved once
+ERROR_ENTRY_TYPE = entryTypes['error']
+
+# Aggregate per dataset on the backend: hourly bins are split into the
+# last 3 hours (recent) and everything before (older), then compared.
+# A source silent now but not in any older bin is Worse with a null change_percent,
+# without older bins there is no baseline and the source is Stable
+TRENDS_QUERY_TEMPLATE = """
+config timeframe = {timeframe_hours}h
+| dataset = custom.data_source_health
+{dataset_filter}
+| bin check_time span=1h as hour_bucket
+| stats 
+    avg(hours_silent) as avg_hours_silent
+  by hour_bucket, dataset_name
+| alter is_recent = if(timestamp_diff(current_time(), hour_bucket, "HOUR") < 3, 1, 0)
+| alter 
+    recent_silent = if(is_recent = 1, avg_hours_silent, 0),
+    older_silent = if(is_recent = 0, avg_hours_silent, 0)
+| stats 
+    sum(recent_silent) as recent_sum,
+    countif(is_recent = 1) as recent_count,
+    sum(older_silent) as older_sum,
+    countif(is_recent = 0) as older_count
+  by dataset_name
+| alter 
+    recent_avg = if(recent_count > 0, recent_sum / recent_count, 0),
+    older_avg = if(older_count > 0, older_sum / older_count, 0)
+| alter 
+    change_percent = case(
+        older_avg > 0, round(((recent_avg - older_avg) / older_avg) * 100, 1),
+        older_count > 0 and recent_avg > 0, null,
+        else, 0
+    ),
+    trend = case(
+        recent_count = 0, "Stable",
+        older_count = 0, "Stable",
+        older_avg = 0 and recent_avg > 0, "Worse",
+        older_avg = 0, "Stable",
+        recent_avg > older_avg * 1.5, "Worse",
+        recent_avg < older_avg * 0.5, "Better",
+        else, "Stable"
+    )
+| fields dataset_name, recent_avg, older_avg, change_percent, trend
+"""
+
+# Allowed dataset names, anything else could break out of the quoted XQL literal
+DATASET_NAME_PATTERN = re.compile(r'[A-Za-z0-9_.-]+')
+
+# Query variants for all datasets and for a single dataset, only the
+# timeframe and dataset name are injected per call
+ALL_TRENDS_QUERY_TEMPLATE = TRENDS_QUERY_TEMPLATE.replace('{dataset_filter}', '')
+DATASET_TRENDS_QUERY_TEMPLATE = TRENDS_QUERY_TEMPLATE.replace(
+    '{dataset_filter}', '| filter dataset_name = "{dataset_name}"'
+)
+
+def format_trend(row: Dict) -> Dict:
+    """
+    Format a per-dataset trend row for context output
+    """
+    return {
+        'dataset': row.get('dataset_name'),
+        'recent_avg_silent': round(row.get('recent_avg', 0), 2),
+        'older_avg_silent': round(row.get('older_avg', 0), 2),
+        'change_percent': row.get('change_percent')
+    }
+
 def get_health_trends(dataset_name: str = None, timeframe_hours: int = 24) -> Dict:
     """
     Get health trends from the custom dataset
+    Query errors are raised so main reports them once
     """
     
-    # Build query based on parameters
-    dataset_filter = f'| filter dataset_name = "{dataset_name}"' if dataset_name else ''
+    if dataset_name:
+        # The XQL command has no bind parameters, so only whitelisted names are interpolated
+        if not DATASET_NAME_PATTERN.fullmatch(dataset_name):
+            raise DemistoException(f"Invalid dataset name: {dataset_name!r}")
+        xql_query = DATASET_TRENDS_QUERY_TEMPLATE.format(
+            timeframe_hours=int(timeframe_hours), dataset_name=dataset_name
+        )
+    else:
+        xql_query = ALL_TRENDS_QUERY_TEMPLATE.format(timeframe_hours=int(timeframe_hours))
     
-    xql_query = f"""
-    config timeframe = {timeframe_hours}h
-    | dataset = custom.data_source_health
-    {dataset_filter}
-    | bin check_time span=1h as hour_bucket
-    | stats 
-        avg(hours_silent) as avg_hours_silent,
-        max(hours_silent) as max_hours_silent,
-        count() as check_count,
-        countif(status = "Silent") as silent_count
-      by hour_bucket, dataset_name
-    | alter silent_percentage = (silent_count / check_count) * 100
-    | sort hour_bucket asc
-    """
+    results = demisto.executeCommand('xdr-xql-generic-query', {
+        'query': xql_query
+    })
+    
+    if not results or results[0].get('Type') == ERROR_ENTRY_TYPE:
+        error = results[0].get('Contents') if results else 'no results returned'
+        raise DemistoException(f"Failed to get trends: {error}")
     
+    # One row per dataset, already classified by the query
+    trend_data = results[0].get('Contents', {}).get('results', [])
+    
+    # Group by trend label in a single pass
+    trends_by_label = defaultdict(list)
+    for row in trend_data:
+        trends_by_label[row.get('trend')].append(row)
+    
+    return {
+        'raw_trends': trend_data,
+        'trending_worse': [format_trend(row) for row in trends_by_label['Worse']],
+        'trending_better': [format_trend(row) for row in trends_by_label['Better']],
+        'dataset_count': len(trend_data)
+    }
+
+# Main execution
+def main():
     try:
-        results = demisto.executeCommand('xdr-xql-generic-query', {
-            'query': xql_query
-        })
-        
-        if not results or results[0].get('Type') == entryTypes['error']:
-            return_error(f"Failed to get trends: {results[0].get('Contents')}")
-        
-        trend_data = results[0].get('Contents', {}).get('results', [])
-        
-        # Analyze trends
-        trending_worse = []
-        trending_better = []
-        
-        # Group by dataset
-        dataset_trends = {}
-        for row in trend_data:
-            ds_name = row.get('dataset_name')
-            if ds_name not in dataset_trends:
-                dataset_trends[ds_name] = []
-            dataset_trends[ds_name].append(row)
-        
-        # Analyze each dataset
-        for ds_name, trends in dataset_trends.items():
-            if len(trends) >= 2:
-                # Compare recent vs older
-                recent_avg = sum(t['avg_hours_silent'] for t in trends[-3:]) / min(3, len(trends))
-                older_avg = sum(t['avg_hours_silent'] for t in trends[:-3]) / max(1, len(trends) - 3)
-                
-                if recent_avg > older_avg * 1.5:
-                    trending_worse.append({
-                        'dataset': ds_name,
-                        'recent_avg_silent': round(recent_avg, 2),
-                        'older_avg_silent': round(older_avg, 2),
-                        'change_percent': round(((recent_avg - older_avg) / older_avg) * 100, 1)
-                    })
-                elif recent_avg < older_avg * 0.5:
-                    trending_better.append({
-                        'dataset': ds_name,
-                        'recent_avg_silent': round(recent_avg, 2),
-                        'older_avg_silent': round(older_avg, 2),
-                        'change_percent': round(((recent_avg - older_avg) / older_avg) * 100, 1)
-                    })
-        
-        return {
-            'raw_trends': trend_data,
-            'trending_worse': trending_worse,
-            'trending_better': trending_better,
-            'dataset_count': len(dataset_trends)
-        }
+        args = demisto.args()
+        dataset_name = args.get('dataset_name')
+        timeframe_hours = int(args.get('timeframe_hours', 24))
         
+        trends = get_health_trends(dataset_name, timeframe_hours)
     except Exception as e:
         return_error(f"Error analyzing trends: {str(e)}")
-
-# Main execution
-def main():
-    args = demisto.args()
-    dataset_name = args.get('dataset_name')
-    timeframe_hours = int(args.get('timeframe_hours', 24))
-    
-    trends = get_health_trends(dataset_name, timeframe_hours)
     
     # Create readable output
-    readable = f"## Data Source Health Trends ({timeframe_hours}h)\n\n"
+    readable_parts = [f"## Data Source Health Trends ({timeframe_hours}h)\n\n"]
     
     if trends['trending_worse']:
-        readable += "### Trending Worse\n"
-        for ds in trends['trending_worse']:
-            readable += f"- **{ds['dataset']}**: {ds['change_percent']}% increase in silence periods\n"
-        readable += "\n"
+        readable_parts.append("### Trending Worse\n")
+        readable_parts.extend(
+            f"- **{ds['dataset']}**: newly silent ({ds['recent_avg_silent']}h average, previously 0h)\n"
+            if ds['change_percent'] is None else
+            f"- **{ds['dataset']}**: {ds['change_percent']}% increase in silence periods\n"
+            for ds in trends['trending_worse']
+        )
+        readable_parts.append("\n")
     
     if trends['trending_better']:
-        readable += "### Trending Better\n"
-        for ds in trends['trending_better']:
-            readable += f"- **{ds['dataset']}**: {ds['change_percent']}% decrease in silence periods\n"
-        readable += "\n"
+        readable_parts.append("### Trending Better\n")
+        readable_parts.extend(
+            f"- **{ds['dataset']}**: {ds['change_percent']}% decrease in silence periods\n"
+            for ds in trends['trending_better']
+        )
+        readable_parts.append("\n")
     
-    readable += f"*Analyzed {trends['dataset_count']} data sources*"
+    readable_parts.append(f"*Analyzed {trends['dataset_count']} data sources*")
+    readable = "".join(readable_parts)
     
     return_outputs(
         readable_output=readable,